@@ -6,192 +6,720 @@ A simple command line tool to allow execution of SQL on Excel and CSV files by c
 """
 
 import sqlite3
+import csv
+import itertools
+import hashlib
+import functools
+import subprocess
+import concurrent.futures
+import multiprocessing
+import json
+import tempfile
 import pandas as pd
 import numpy as np
+import xlsxwriter
 import argparse
 import os
 import shutil
+import re
+
+# DB files are kept in a folder called "Databases" in the directory where this program is saved
+DB_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "Databases")
+os.makedirs(DB_FOLDER, exist_ok=True)
+
+# read Excel files with the Rust based calamine reader when it is installed, otherwise let pandas pick its default reader
+try:
+    import python_calamine
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+# run queries through the ADBC SQLite driver when it is installed, which returns results as Arrow columns. The driver fixes column types from the first
+# rows it reads and raises an OSError if a later value has another type, in which case queries are run again through sqlite3
+try:
+    import adbc_driver_sqlite.dbapi as adbc_sqlite
+    import adbc_driver_manager
+    import pyarrow.parquet
+except ImportError:
+    adbc_sqlite = None
+
+# number of rows at the start of a CSV file used to infer the column types
+CSV_TYPE_SAMPLE_ROWS = 1000
+# CSV values stored as NULL, the same as pandas' default missing value markers
+CSV_NA_VALUES = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL',
+                           'NaN', 'None', 'n/a', 'nan', 'null'])
+# upper bound on rows sent in one multi row INSERT statement
+INSERT_CHUNK_SIZE = 1000
+# SQLite limit on bound parameters per statement (SQLITE_MAX_VARIABLE_NUMBER) before version 3.32, used when the limit cannot be read from the connection
+SQLITE_MAX_VARIABLES = 999
+# folder inside the Databases folder holding cached query results. Results read into a DataFrame and results streamed to a parquet file are cached,
+# excel and csv results streamed from the DB are not
+QUERY_CACHE_FOLDER = "_qcache"
+# default limit on databases attached to one SQLite connection (SQLITE_MAX_ATTACHED)
+SQLITE_MAX_ATTACHED = 10
+# most commands run at once when several are given in one invocation
+MAX_WORKERS = 4
+# settings applied to every SQLite connection: write ahead logging with fewer fsyncs, a 256 MB page cache, in memory temp storage and 1 GB of memory mapped I/O
+SQLITE_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA cache_size=-262144;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=1073741824;
+"""
+# valid SQLite table and column names: letters, numbers and underscores, not leading with a digit
+SQLITE_ENTITY_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+# object columns with fewer distinct values than this fraction of their rows are converted to categories when downcasting
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+# excel file types that can be imported
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+# query results can be saved as excel (default), parquet or csv files
+OUTPUT_FORMATS = ('.xlsx', '.parquet', '.csv')
+# number of DataFrame rows converted to Python values at a time when writing excel output
+EXCEL_WRITE_CHUNK_SIZE = 10000
+# number of rows an excel sheet can hold, including the row of column names
+EXCEL_MAX_ROWS = 1048576
+# excel output is written in constant memory mode, values are written as is without turning strings into formulas or links
+EXCEL_WRITER_OPTIONS = {'constant_memory': True,
+                        'strings_to_formulas': False,
+                        'strings_to_urls': False,
+                        'nan_inf_to_errors': True,
+                        'default_date_format': 'yyyy-mm-dd hh:mm:ss'}
 
 def main(args):
     """Main method, uses command line inputs to interact with program. Will execute commands based on hiearchy defined in program entry point.
     Arguments:
         args: argparse.Namespace object that holds arguments passed in by the user."""
-    # paths reletive to program's location on machine
-    current_path = os.path.dirname(os.path.realpath(__file__))
-    db_folder = os.path.join(current_path, "Databases")
-    # execute user arguments in order of hiearchy
+    # collect user arguments in order of hiearchy, each paired with the name of the DB it works on or None if it works on all of them
+    tasks = []
     if args.build_db_name is not None:
-        build_db(args.build_db_name, current_path, db_folder)
+        tasks.append((args.build_db_name, functools.partial(build_db, args.build_db_name)))
     if args.delete_db_name is not None:
-        delete_db_path(args.delete_db_name, db_folder)
+        tasks.append((args.delete_db_name, functools.partial(delete_db_path, args.delete_db_name)))
     if args.file_to_import_args is not None:
-        import_file_to_db(args.file_to_import_args, db_folder)
+        tasks.append((args.file_to_import_args[0], functools.partial(import_file_to_db, args.file_to_import_args, args.downcast, args.fast_import)))
     if args.query_to_execute is not None:
-        execute_query(args.query_to_execute, db_folder)
+        query_db_name = args.query_to_execute[3] if len(args.query_to_execute) > 3 else None
+        tasks.append((query_db_name, functools.partial(execute_query, args.query_to_execute, args.as_dataframe)))
     if args.clear_all_data:
-        shutil.rmtree(db_folder)
-        print('Data from all SQlite Databases are deleted.')
+        tasks.append((None, clear_all_data))
     if args.list_all_db_name:
-        list_db(db_folder)
+        tasks.append((None, list_db))
     if args.list_table_db_name:
-        list_tables(args.list_table_db_name, db_folder)
+        tasks.append((args.list_table_db_name, functools.partial(list_tables, args.list_table_db_name)))
+    run_tasks(tasks)
+
+def run_tasks(tasks):
+    """Runs the given tasks, respecting their order for tasks on the same DB. A single task is run directly, otherwise tasks are run on a thread pool
+        so work on different DBs overlaps, with each task first waiting on the earlier tasks that use its DB or all DBs.
+    Arguments:
+        tasks: list of (db_name, function) pairs in order of hiearchy, db_name is None for tasks that work on every DB"""
+    if len(tasks) <= 1:
+        for db_name, task in tasks:
+            task()
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = []
+        for db_name, task in tasks:
+            depends_on = [future for future_db_name, future in futures
+                          if db_name is None or future_db_name is None or future_db_name == db_name]
+            futures.append((db_name, executor.submit(run_after, depends_on, task)))
+        # raise the first Exception of any task
+        for db_name, future in futures:
+            future.result()
+
+def run_after(depends_on, task):
+    """Helper method that waits for the given futures to finish, raising their Exceptions, then runs the task"""
+    for future in depends_on:
+        future.result()
+    task()
+
+def clear_all_data():
+    """Deletes all SQLite Databases and cached query results, leaving an empty Databases folder"""
+    shutil.rmtree(DB_FOLDER)
+    os.makedirs(DB_FOLDER)
+    print('Data from all SQlite Databases are deleted.')
 
-def build_db(db_name, current_path, db_folder):
+def build_db(db_name):
     """A function that builds a SQLite DB with the given name. Will build the Database in a folder called "Databases" in the directory where this program is saved.
     Arguments:
         db_name: the name of the db to create
-        current_path: the directory where this program lives
-        db_folder: where the folder with DB files shoule be located
     """
-    # if "Databases" folder does not exist, create it
-    if os.path.exists(db_folder) == False:
-        os.makedirs(db_folder)
     db_file = db_name + ".db"
-    db_path = os.path.join(db_folder, db_file)
+    db_path = os.path.join(DB_FOLDER, db_file)
     # make the db
-    conn = sqlite3.connect(r"{}".format(db_path))
+    conn = open_db(db_path)
     conn.close()
     print('Successfully created SQLite Database ', "'{}'".format(db_file)) 
 
-def delete_db_path(db_name, db_folder):
+def open_db(db_path, factory=sqlite3.Connection):
+    """helper method that opens a connection to the SQLite DB at the given path with the program's PRAGMA settings applied"""
+    conn = sqlite3.connect(db_path, factory=factory)
+    conn.executescript(SQLITE_PRAGMAS)
+    return conn
+
+class SingleTransactionConnection(sqlite3.Connection):
+    """SQLite connection that ignores commit and rollback calls. pandas' to_sql commits after every table, with this connection the tables written
+        inside a "with conn:" block are committed or rolled back together when the block exits"""
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+def delete_db_path(db_name):
     """Delete the given DB name
     Arguments:
         db_name: the name of the DB to delete
-        db_folder: where the folder of Database files resides
     """
     # Full file path of DB
     db_file = db_name + ".db"
-    full_db_path = os.path.join(db_folder, db_file)
-    try:
-        os.remove(full_db_path)
-        print('Successfully deleted SQLite Database ', "'{}'".format(db_file))
-    except(FileNotFoundError):
+    full_db_path = os.path.join(DB_FOLDER, db_file)
+    if not os.path.isfile(full_db_path):
         error_str = 'There is no database with the name ' + db_name + '. Did you specify the correct name of the Database you want to delete?'
         raise Exception(error_str)
+    os.remove(full_db_path)
+    clear_query_cache(db_name)
+    print('Successfully deleted SQLite Database ', "'{}'".format(db_file))
 
-def import_file_to_db(import_file_args, db_folder):
+def import_file_to_db(import_file_args, downcast=False, fast_import=False):
     """Parses import_file argument to import csv or excel files into the passed in db.
     Arguments:
         import_file_args: arguments passed in to the import file command in a list. First position is the name of the DB, second is the file, third is the name of the table,
-                            and fourth is an optional argument for XLSX files for the sheetname to read in the table from.
-        db_folder: the folder where the DB files are stored
+                            and fourth is an optional argument for XLSX files for the sheetname to read in the table from. More table and sheetname pairs can follow
+                            to import several sheets of the same XLSX file. If the second position is a .json manifest of files, there are no other arguments.
+        downcast: if True, excel data is downcast to smaller dtypes before it is written to the DB
+        fast_import: if True, rows of CSV files are loaded by the sqlite3 command line tool instead of through Python
         ***TO READ DATA IN PROPERLY, TABLE NEEDS TO START IN THE FIRST COLUMN AND FIRST ROW SHOULD BE COLUMN HEADERS"""
     # user args
     db_name = import_file_args[0]
     data_path = import_file_args[1]
-    table_name = import_file_args[2]
-    # check that table name is valid
-    check_sqlite_entity_syntax(table_name, "Table")
-    # read in the data as a DataFrame
-    data_path = r"{}".format(data_path)
-    if data_path[-3:] == 'csv':
-        if import_file_args[2]:
-            raise TypeError('Cannot pass in a sheet name with a CSV file')
-        data = pd.read_csv(data_path)
-    elif data_path[-4:] == 'xlsx':
-        if len(import_file_args) == 4:
-            data = pd.read_excel(data_path, sheet_name = import_file_args[3])
-        else:
-            data = pd.read_excel(data_path)
-    else:
-        raise TypeError("Unsuported File extension. Supported formats are .xlsx and .csv")
-    # check that column names are valid. 
-    for col in data.columns:
-        check_sqlite_entity_syntax(col, "Column")
-    # import Dataframe to the intended Database
-    db_name = import_file_args[0]
     db_file = db_name + ".db"
-    db_path = os.path.join(db_folder, db_file)
-    db_exists = False
-    for db_file_name in os.listdir(db_folder):
-        if db_file_name == db_file:
-            db_exists = True
-    if db_exists:
-        conn = sqlite3.connect(db_path)
-    else:
+    db_path = os.path.join(DB_FOLDER, db_file)
+    if not os.path.isfile(db_path):
         error_str = 'There is no database with the name ' + db_name + '. Did you create the database before importing the file?'
         raise Exception(error_str)
-    data.to_sql(name=import_file_args[2], con=conn, if_exists='fail')
-    conn.close()
+    # a JSON file on its own lists the files to import
+    if len(import_file_args) == 2 and get_extension(data_path) == '.json':
+        import_manifest_to_db(db_path, data_path, downcast, fast_import)
+        print('Successfully imported files in', "'{}'".format(data_path), 'to', "'{}'".format(db_file))
+        return
+    # the rest of the args are table names, for XLSX files each followed by the sheet to read the table from
+    table_args = import_file_args[2:]
+    if len(table_args) == 1:
+        table_sheets = [(table_args[0], 0)]
+    elif len(table_args) > 0 and len(table_args) % 2 == 0:
+        table_sheets = list(zip(table_args[0::2], table_args[1::2]))
+    else:
+        raise Exception('Enter the name of the table to import the file into, or pairs of table and sheet names to import several sheets from an XLSX file.')
+    if get_extension(data_path) == '.csv':
+        if len(import_file_args) > 3:
+            raise TypeError('Cannot pass in a sheet name with a CSV file')
+    import_tables(db_path, data_path, table_sheets, downcast, fast_import)
     print('Successfully imported file ', "'{}'".format(import_file_args[1]), 'to', "'{}'".format(db_file))
 
-def execute_query(execute_query_args, db_folder):
+def import_tables(db_path, data_path, table_sheets, downcast=False, fast_import=False):
+    """Imports tables from a csv or excel file into the SQLite DB at the given path.
+    Arguments:
+        db_path: path to the SQLite DB to import the tables into
+        data_path: path to the csv or excel file
+        table_sheets: list of (table name, sheet name) pairs to import, the sheet name is ignored for CSV files
+        downcast: if True, excel data is downcast to smaller dtypes before it is written to the DB
+        fast_import: if True, rows of CSV files are loaded by the sqlite3 command line tool instead of through Python"""
+    # check that table names are valid
+    for table_name, _ in table_sheets:
+        check_sqlite_entity_syntax(table_name, "Table")
+    extension = get_extension(data_path)
+    is_csv = extension == '.csv'
+    if not is_csv and extension not in EXCEL_EXTENSIONS:
+        raise TypeError("Unsuported File extension. Supported formats are .csv, " + ", ".join(EXCEL_EXTENSIONS))
+    conn = open_db(db_path, factory=SingleTransactionConnection)
+    if is_csv and fast_import:
+        # create the table, then let the sqlite3 command line tool load the rows
+        csv_to_table(conn, data_path, table_sheets[0][0], load_rows=False)
+        conn.close()
+        cli_import_csv(db_path, data_path, table_sheets[0][0])
+    elif is_csv:
+        # CSV files are streamed straight into the Database
+        csv_to_table(conn, data_path, table_sheets[0][0])
+    else:
+        # all sheets are read from the same parsed workbook
+        excel_file = get_excel_file(data_path)
+        # every sheet is parsed and checked before any table is written
+        sheets = []
+        for table_name, sheet_name in table_sheets:
+            data = excel_file.parse(sheet_name)
+            # check that column names are valid.
+            check_column_names(data.columns)
+            if downcast:
+                downcast_dataframe(data)
+            sheets.append((table_name, data))
+        # all tables are written in a single transaction, so a failed sheet leaves none of them in the DB
+        with conn:
+            conn.execute('BEGIN')
+            for table_name, data in sheets:
+                data.to_sql(name=table_name, con=conn, if_exists='fail', index=False,
+                            method='multi', chunksize=get_insert_chunksize(conn, data))
+    conn.close()
+
+def import_manifest_to_db(db_path, manifest_path, downcast=False, fast_import=False):
+    """Imports every file listed in a JSON manifest. Files are imported in parallel by separate processes, each into its own temporary DB so they do not wait
+        on SQLite's single writer lock, then the tables are copied into the target DB with ATTACH. Either every table in the manifest is imported or none are.
+    Arguments:
+        db_path: path to the SQLite DB to import the files into
+        manifest_path: path to a JSON file holding a list of objects, each with the "file" to import, the "table" to import it into and an optional "sheet" for XLSX files
+        downcast: if True, excel data is downcast to smaller dtypes before it is written to the DB
+        fast_import: if True, rows of CSV files are loaded by the sqlite3 command line tool instead of through Python"""
+    with open(manifest_path, 'r') as fh:
+        entries = json.load(fh)
+    table_names = []
+    for entry in entries:
+        if 'file' not in entry or 'table' not in entry:
+            raise Exception('Every entry in the manifest ' + manifest_path + ' needs a "file" and a "table".')
+        check_sqlite_entity_syntax(entry['table'], "Table")
+        if entry.get('sheet') is not None and get_extension(entry['file']) == '.csv':
+            raise TypeError('Cannot pass in a sheet name with a CSV file')
+        table_names.append(entry['table'])
+    if len(set(table_names)) != len(table_names):
+        raise Exception('Every entry in the manifest ' + manifest_path + ' needs a different table name.')
+    if not entries:
+        return
+    # check for tables that already exist before any file is read. SQLite table names are case insensitive
+    conn = open_db(db_path)
+    existing_tables = {name.lower() for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    conn.close()
+    existing_names = [table_name for table_name in table_names if table_name.lower() in existing_tables]
+    if existing_names:
+        raise Exception('The tables ' + ', '.join(existing_names) + ' from the manifest ' + manifest_path + ' already exist in the Database.')
+    temp_folder = tempfile.mkdtemp(prefix='_import_', dir=DB_FOLDER)
+    conn = None
+    try:
+        worker_paths = [os.path.join(temp_folder, 'worker_{}.db'.format(k)) for k in range(len(entries))]
+        # workers are spawned rather than forked, as this can run in a thread of the command thread pool and forking a threaded process is unsafe
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(entries), os.cpu_count() or 1),
+                                                    mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(import_tables, worker_path, entry['file'], [(entry['table'], get_manifest_sheet(entry))], downcast, fast_import)
+                       for worker_path, entry in zip(worker_paths, entries)]
+            for future in futures:
+                future.result()
+        # copy the tables into the target DB. Databases cannot be attached inside a transaction, so they are attached in batches the size of SQLite's limit
+        conn = open_db(db_path)
+        workers = list(zip(worker_paths, table_names))
+        copied_tables = []
+        try:
+            for start in range(0, len(workers), SQLITE_MAX_ATTACHED):
+                batch = workers[start:start + SQLITE_MAX_ATTACHED]
+                for k, (worker_path, table_name) in enumerate(batch):
+                    conn.execute('ATTACH DATABASE ? AS worker_{}'.format(k), (worker_path,))
+                with conn:
+                    conn.execute('BEGIN')
+                    for k, (worker_path, table_name) in enumerate(batch):
+                        create_sql = conn.execute("SELECT sql FROM worker_{}.sqlite_master WHERE type='table' AND name=?".format(k), (table_name,)).fetchone()[0]
+                        conn.execute(create_sql)
+                        conn.execute('INSERT INTO main."{0}" SELECT * FROM worker_{1}."{0}"'.format(table_name, k))
+                copied_tables.extend(table_name for _, table_name in batch)
+                for k in range(len(batch)):
+                    conn.execute('DETACH DATABASE worker_{}'.format(k))
+        except Exception:
+            # each batch is committed on its own, so the tables copied by earlier batches are dropped again to leave the DB as it was
+            with conn:
+                conn.execute('BEGIN')
+                for table_name in copied_tables:
+                    conn.execute('DROP TABLE main."{}"'.format(table_name))
+            raise
+    finally:
+        if conn is not None:
+            conn.close()
+        shutil.rmtree(temp_folder)
+
+def get_manifest_sheet(entry):
+    """helper method that returns the sheet to import for a manifest entry, the first sheet if no sheet or a null sheet is given"""
+    return entry['sheet'] if entry.get('sheet') is not None else 0
+
+def get_extension(data_path):
+    """Helper method that returns the lower case extension of a file path, such as '.csv'"""
+    return os.path.splitext(data_path.strip())[1].lower()
+
+def get_excel_file(data_path):
+    """Helper method that returns the parsed workbook for an excel file. Workbooks are cached by path and modification time so importing several sheets,
+        or the same file again, only parses the file once"""
+    data_path = os.path.abspath(data_path)
+    return open_excel_file(data_path, os.path.getmtime(data_path))
+
+@functools.lru_cache(maxsize=8)
+def open_excel_file(data_path, mtime):
+    """Opens an excel workbook, mtime is only used as part of the cache key so a changed file is parsed again"""
+    return pd.ExcelFile(data_path, engine = EXCEL_ENGINE)
+
+def downcast_dataframe(data):
+    """Converts the columns of a DataFrame in place to the smallest dtypes that hold their values to reduce memory use while importing. Integers are downcast
+        to the smallest (unsigned if possible) integer type, floats to float32 only when no precision is lost, and text columns with few distinct values to categories"""
+    for col in data.select_dtypes(include='integer').columns:
+        data[col] = pd.to_numeric(data[col], downcast='unsigned' if data[col].min() >= 0 else 'integer')
+    for col in data.select_dtypes(include='float').columns:
+        downcast_col = pd.to_numeric(data[col], downcast='float')
+        if downcast_col.astype(data[col].dtype).equals(data[col]):
+            data[col] = downcast_col
+    for col in data.select_dtypes(include=['object', 'string']).columns:
+        if len(data) > 0 and data[col].nunique() / len(data) < CATEGORY_MAX_UNIQUE_RATIO:
+            data[col] = data[col].astype('category')
+
+def csv_to_table(conn, data_path, table_name, load_rows=True):
+    """Streams the rows of a CSV file straight into a new table without building a DataFrame. Column types are inferred from the first rows of the file and
+        SQLite's type affinity converts the text values as they are inserted.
+    Arguments:
+        conn: open connection to the SQLite DB to create the table in
+        data_path: path to the CSV file, first row should be the column headers
+        table_name: name of the table to create
+        load_rows: if False, only the empty table is created"""
+    with open(data_path, newline='', encoding='utf-8-sig') as fh:
+        reader = csv.reader(fh)
+        headers = next(reader, None)
+        if headers is None:
+            raise Exception('The given CSV file ' + data_path + ' is empty.')
+        # check that column names are valid.
+        check_column_names(headers)
+        # SQLite column names are case insensitive, so headers differing only in case are duplicates too
+        lower_headers = [col.lower() for col in headers]
+        duplicate_cols = [col for i, col in enumerate(headers) if col.lower() in lower_headers[:i]]
+        if duplicate_cols:
+            raise Exception('Duplicate column names ' + ', '.join(duplicate_cols) + ' in the CSV file ' + data_path + '. Each column must have a unique name.')
+        # keep the line number of each row for error messages
+        numbered_rows = ((reader.line_num, row) for row in reader)
+        sample = list(itertools.islice(numbered_rows, CSV_TYPE_SAMPLE_ROWS))
+        sample_rows = [row for _, row in sample]
+        col_defs = ', '.join('"{}" {}'.format(col, infer_sqlite_type(sample_rows, i)) for i, col in enumerate(headers))
+        insert = 'INSERT INTO "{}" VALUES ({})'.format(table_name, ', '.join('?' * len(headers)))
+        rows = csv_rows(itertools.chain(sample, numbered_rows), len(headers), data_path)
+        # table creation and all inserts happen in a single transaction
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('CREATE TABLE "{}" ({})'.format(table_name, col_defs))
+            if load_rows:
+                conn.executemany(insert, rows)
+
+def csv_rows(numbered_rows, n_cols, data_path):
+    """Helper generator that turns rows read from a CSV file into the values of an INSERT, the same way pandas reads them in. Blank lines are skipped,
+        missing value markers are stored as NULL and short rows are padded with NULL.
+    Arguments:
+        numbered_rows: iterable of (line number, row) pairs
+        n_cols: number of columns in the header
+        data_path: path to the CSV file, used in error messages"""
+    for line_num, row in numbered_rows:
+        if not row:
+            continue
+        if len(row) > n_cols:
+            raise Exception('Line ' + str(line_num) + ' of the CSV file ' + data_path + ' has ' + str(len(row)) + ' values but there are only '
+                            + str(n_cols) + ' column headers.')
+        values = [value if value not in CSV_NA_VALUES else None for value in row]
+        values.extend([None] * (n_cols - len(values)))
+        yield values
+
+def cli_import_csv(db_path, data_path, table_name):
+    """Loads the rows of a CSV file into an existing table with the sqlite3 command line tool's .import command, which parses and inserts the rows in C
+        without going through the SQL parser or Python. Empty fields are stored as empty strings rather than NULL. The table is dropped if the import fails"""
+    error_str = None
+    if shutil.which('sqlite3') is None:
+        error_str = 'The sqlite3 command line tool must be installed and on the PATH to use --fast_import.'
+    elif "'" in data_path:
+        error_str = 'Cannot use --fast_import with a file path containing a single quote.'
+    else:
+        import_cmd = ".import --csv --skip 1 '{}' {}".format(data_path, table_name)
+        if subprocess.run(['sqlite3', '-bail', db_path, import_cmd]).returncode != 0:
+            error_str = 'The sqlite3 command line tool could not import ' + data_path + '.'
+    if error_str is not None:
+        # remove the empty table created for the import
+        conn = open_db(db_path)
+        with conn:
+            conn.execute('DROP TABLE "{}"'.format(table_name))
+        conn.close()
+        raise Exception(error_str)
+
+def infer_sqlite_type(sample, col_index):
+    """Helper method that returns the SQLite type (INTEGER, REAL or TEXT) for a column of CSV rows based on its non missing values in the given sample"""
+    sqlite_type = None
+    for row in sample:
+        if col_index >= len(row) or row[col_index] in CSV_NA_VALUES:
+            continue
+        value = row[col_index]
+        if sqlite_type in (None, 'INTEGER'):
+            try:
+                int(value)
+                sqlite_type = 'INTEGER'
+                continue
+            except ValueError:
+                pass
+        try:
+            float(value)
+            sqlite_type = 'REAL'
+        except ValueError:
+            return 'TEXT'
+    # columns with no values in the sample are left as text
+    return sqlite_type or 'TEXT'
+
+def get_insert_chunksize(conn, data):
+    """Helper method that returns how many rows of the given DataFrame can be sent in one multi row INSERT without passing the bound parameter limit of
+        the SQLite library the connection uses."""
+    try:
+        max_variables = conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    except AttributeError:
+        # Connection.getlimit was added in Python 3.11, older versions use the lowest limit SQLite has shipped with
+        max_variables = SQLITE_MAX_VARIABLES
+    return max(1, min(INSERT_CHUNK_SIZE, max_variables // max(1, len(data.columns))))
+
+def execute_query(execute_query_args, as_dataframe=False):
     """executes a given query against a given DB
     Arguments:
         execute_query_args: list holding arguments passed in from user. First arg is the query as a str or in a .txt file, second is the folder to save the result query,
                             third is the name to save the result file as, fourth is the DB to run the query on, last is an optional argument that if specified as "clear" will 
                             clear the DB the query was run on
-        db_folder: folder where the SQLite DB files are stored."""
+        as_dataframe: if True, the result is read into a DataFrame before it is saved rather than streamed from the DB into the output file"""
         
     # parameters from the user
     query = get_query(execute_query_args[0])
     output_dir = execute_query_args[1]
-    output_name = execute_query_args[2] + '.xlsx'
+    output_name = execute_query_args[2]
+    if os.path.splitext(output_name)[1].lower() not in OUTPUT_FORMATS:
+        output_name += '.xlsx'
     db_name = execute_query_args[3]
     # the file
     db_file = db_name + ".db"
-    db_path = os.path.join(db_folder, db_file)
-    try:
-        conn = sqlite3.connect(db_path)
-    except(sqlite3.OperationalError):
+    db_path = os.path.join(DB_FOLDER, db_file)
+    if not os.path.isfile(db_path):
         error_str = 'There is no database with the name ' + db_name + '. Did you create the database before running the query?'
         raise Exception(error_str)
         
-    # connect and execute
     output_path = os.path.join(output_dir, output_name)
-    try:
-        result = pd.read_sql_query(query, conn)
-    except(pd.io.sql.DatabaseError):
-        error_str = 'There is an error in the query. Did you import the table from an excel file into ' + db_name +'?'
-        raise Exception(error_str)
-    if 'index' in result.columns:
-        result.drop('index', inplace = True, axis = 1)
-    result.to_excel(output_path, index = False)
-    conn.close()
+    error_str = 'There is an error in the query. Did you import the table from an excel file into ' + db_name +'?'
+    # reuse the cached result of the query if the DB has not changed since it was saved. This is checked before connecting to the DB
+    cache_path = get_query_cache_path(query, db_name)
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) > get_db_mtime(db_path):
+        write_result(pd.read_parquet(cache_path), output_path)
+    else:
+        # connect and execute
+        conn = open_db(db_path)
+        if not as_dataframe and output_path.lower().endswith('.xlsx'):
+            # stream rows from the cursor straight into the excel file without building a DataFrame
+            try:
+                cursor = conn.execute(query)
+            except (sqlite3.Error, sqlite3.Warning):
+                raise Exception(error_str)
+            write_excel([column[0] for column in cursor.description or []], cursor, output_path)
+        elif not as_dataframe and write_arrow_result(query, db_path, output_path):
+            # parquet and csv results were streamed straight from the DB as Arrow record batches, a parquet result is already in the cache's format
+            if output_path.lower().endswith('.parquet'):
+                save_query_cache_file(output_path, cache_path)
+        else:
+            try:
+                # the ADBC driver was already tried above unless the result is read as a DataFrame
+                result = read_query(query, conn, db_path, use_adbc=as_dataframe)
+            except(pd.io.sql.DatabaseError):
+                raise Exception(error_str)
+            save_query_cache(result, cache_path)
+            write_result(result, output_path)
+        conn.close()
     print('Query ran succesfully. Output found at', output_path)
     
     # clear the current Database if argument supplied
     if len(execute_query_args) == 5:
         if execute_query_args[4] == "clear":
-            delete_db_path(db_name, db_folder)
+            delete_db_path(db_name)
         else:
             print('The fifth argument', execute_query_args[4], 'is not understood, so know data was deleted. Can supply fourth positional argument "clear" to --execute_query to delete the Database after running a query')
 
+def read_query(query, conn, db_path, use_adbc=True):
+    """helper method that runs a query and returns the result as a DataFrame. Uses the ADBC driver when installed so the result is filled column by column
+        from Arrow buffers instead of converting every row through Python objects, otherwise falls back to pandas on the given sqlite3 connection.
+        use_adbc is False when the ADBC driver already failed to read the result, so the query goes straight to pandas"""
+    if use_adbc and adbc_sqlite is not None:
+        try:
+            with adbc_sqlite.connect(db_path) as adbc_conn:
+                with adbc_conn.cursor() as cursor:
+                    cursor.execute(query)
+                    reader = cursor.fetch_record_batch()
+                    table = pyarrow.Table.from_batches(read_batches(reader), schema=reader.schema)
+                    return table.to_pandas(types_mapper=pd.ArrowDtype)
+        except adbc_sqlite.Error:
+            pass
+    return pd.read_sql_query(query, conn)
+
+def write_arrow_result(query, db_path, output_path):
+    """helper method that runs a query with the ADBC driver and writes the Arrow record batches it returns straight into a parquet or csv file, one batch
+        at a time, without building a DataFrame. Returns False without writing anything if the driver is not installed or cannot read the result"""
+    if adbc_sqlite is None:
+        return False
+    # the output file is only removed on failure once the writer has created it, so a query error leaves an existing file at the path alone
+    writer = None
+    try:
+        with adbc_sqlite.connect(db_path) as adbc_conn:
+            with adbc_conn.cursor() as cursor:
+                cursor.execute(query)
+                reader = cursor.fetch_record_batch()
+                if output_path.lower().endswith('.parquet'):
+                    writer = pyarrow.parquet.ParquetWriter(output_path, reader.schema)
+                    with writer:
+                        for batch in read_batches(reader):
+                            writer.write_batch(batch)
+                else:
+                    # pyarrow's CSV writer quotes every string and column name, so each batch is written by pandas to quote values the same way
+                    # as csv results saved from a DataFrame
+                    writer = open(output_path, 'w', newline='')
+                    with writer:
+                        pd.DataFrame(columns=reader.schema.names).to_csv(writer, index=False)
+                        for batch in read_batches(reader):
+                            batch.to_pandas(types_mapper=pd.ArrowDtype).to_csv(writer, index=False, header=False)
+    except adbc_sqlite.Error:
+        if writer is not None:
+            remove_output(output_path)
+        return False
+    except Exception:
+        # errors writing the output file are raised, without leaving a partly written file behind
+        if writer is not None:
+            remove_output(output_path)
+        raise
+    return True
+
+def read_batches(reader):
+    """helper generator that yields the record batches of an ADBC result. The SQLite driver sets the type of each column from the first rows of the
+        result and raises a plain OSError if a later value has another type, which is raised again as an ADBC error so it is handled like the driver's
+        other errors rather than like an error writing the output"""
+    while True:
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            return
+        except OSError as error:
+            raise adbc_sqlite.DataError(str(error), status_code=adbc_driver_manager.AdbcStatusCode.INVALID_DATA) from error
+        yield batch
+
+def write_result(result, output_path):
+    """helper method that saves a query result DataFrame as a parquet or csv file if the output path ends in .parquet or .csv, otherwise as an excel file"""
+    if output_path.lower().endswith('.parquet'):
+        try:
+            result.to_parquet(output_path, index=False)
+        except (ValueError, TypeError):
+            # pyarrow cannot store a column holding mixed types, such as text and numbers from a column SQLite allowed both in. These columns
+            # are written as text instead, keeping missing values as nulls
+            mixed_columns = result.select_dtypes(include='object').columns
+            result.astype({column: 'string' for column in mixed_columns}).to_parquet(output_path, index=False)
+    elif output_path.lower().endswith('.csv'):
+        result.to_csv(output_path, index=False)
+    else:
+        write_excel(list(result.columns), dataframe_rows(result), output_path)
+
+def write_excel(columns, rows, output_path):
+    """helper method that writes column names and rows of values to an excel file in row order. The workbook is in constant memory mode so each row
+        is flushed to disk once the next one starts, rather than holding the whole workbook in memory"""
+    workbook = xlsxwriter.Workbook(output_path, EXCEL_WRITER_OPTIONS)
+    worksheet = workbook.add_worksheet('result')
+    try:
+        worksheet.write_row(0, 0, columns)
+        for i, row in enumerate(rows, start=1):
+            if i >= EXCEL_MAX_ROWS:
+                raise Exception('The query result has more rows than an excel sheet can hold (' + str(EXCEL_MAX_ROWS - 1) + '). Save the output as a .parquet or .csv file instead.')
+            worksheet.write_row(i, 0, row)
+        workbook.close()
+    except TypeError:
+        remove_output(output_path)
+        raise Exception('The query result holds values that cannot be written to an excel file, such as BLOB data. Save the output as a .parquet or .csv file instead.')
+    except Exception:
+        # do not leave a partly written excel file behind
+        remove_output(output_path)
+        raise
+
+def remove_output(output_path):
+    """helper method that deletes an output file if it exists"""
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+def dataframe_rows(data):
+    """helper generator that yields the rows of a DataFrame as tuples of Python values with missing values as None. Converts a slice of rows at a time
+        so the whole DataFrame is not copied"""
+    for start in range(0, len(data), EXCEL_WRITE_CHUNK_SIZE):
+        chunk = data.iloc[start:start + EXCEL_WRITE_CHUNK_SIZE].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+def get_query_cache_path(query, db_name):
+    """helper method that returns where the cached result of a query run against the given DB is stored. Results are keyed by a hash of the query text"""
+    key = hashlib.blake2b(query.strip().encode(), digest_size=16).hexdigest()
+    return os.path.join(DB_FOLDER, QUERY_CACHE_FOLDER, db_name + '_' + key + '.parquet')
+
+def get_db_mtime(db_path):
+    """helper method that returns when the given DB was last written to. In WAL mode, writes land in the <db>-wal file and only reach the .db file
+        at a checkpoint, so the later of the two modification times is used. Connections that only read the DB create an empty <db>-wal file, which
+        is ignored"""
+    wal_path = db_path + '-wal'
+    if os.path.exists(wal_path) and os.path.getsize(wal_path) > 0:
+        return max(os.path.getmtime(db_path), os.path.getmtime(wal_path))
+    return os.path.getmtime(db_path)
+
+def save_query_cache(result, cache_path):
+    """helper method that saves a query result as a parquet file to be reused by later runs of the same query. Caching is skipped if the result
+        cannot be written as parquet, for example when pyarrow is not installed or a column holds mixed types"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    try:
+        result.to_parquet(cache_path, index=False)
+    except Exception:
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+def save_query_cache_file(result_path, cache_path):
+    """helper method that copies a query result already saved as a parquet file into the query cache"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    shutil.copyfile(result_path, cache_path)
+
+def clear_query_cache(db_name):
+    """helper method that deletes all cached query results for the given DB"""
+    cache_folder = os.path.join(DB_FOLDER, QUERY_CACHE_FOLDER)
+    if not os.path.exists(cache_folder):
+        return
+    cache_name = get_query_cache_path('', db_name)
+    for file_name in os.listdir(cache_folder):
+        # cached files are the DB name followed by a fixed length key
+        if file_name.startswith(db_name + '_') and len(file_name) == len(os.path.basename(cache_name)):
+            os.remove(os.path.join(cache_folder, file_name))
+
 def get_query(user_query):
     """helper method with logic to get the query from the user. Will return the query if given in command line. If given a .txt file, will read the query from the file
         and return"""
-    if user_query[-4:] == '.txt':
+    if user_query.lower().endswith('.txt'):
         with open(user_query,'r') as fh:
-            all_lines = fh.readlines()
-        if len(all_lines) == 0:
+            user_query = fh.read()
+        if not user_query.strip():
             raise Exception('The given file holding the query is empty.')
-        user_query = ''.join(all_lines)
     return user_query 
 
 def check_sqlite_entity_syntax(entity, type_):
     """SQLite Tables and columns follow same guidlines. Helper method that checks if a given object and its type as strings follows syntax, then prints appropriate Exception.
         type_ expected to be capitalized"""
-    if entity.isdigit():
+    entity = str(entity)
+    if SQLITE_ENTITY_RE.fullmatch(entity):
+        return
+    if entity[:1].isdigit():
         raise Exception('Invalid ' + type_.lower() + ' ' + entity + '.' + ' ' + type_ + ' name cannot lead with a digit')
-    # otherwise, should be all alphanumeric characters. Can have _ as well.
-    entity_check = entity.replace("_", "A")
-    if not entity_check.isalnum():
-        raise Exception('Invalid ' + type_.lower() + ' ' + entity + '.' + ' '+ type_ + ' must contain only numbers and letters.')
+    raise Exception('Invalid ' + type_.lower() + ' ' + entity + '.' + ' '+ type_ + ' must contain only numbers, letters and underscores.')
+
+def check_column_names(columns):
+    """Helper method that checks all given column names in one pass and raises a single Exception listing every invalid name"""
+    bad_cols = [str(col) for col in columns if not SQLITE_ENTITY_RE.fullmatch(str(col))]
+    if bad_cols:
+        raise Exception('Invalid column names ' + ', '.join(bad_cols) + '. Column names must contain only numbers, letters and underscores and cannot lead with a digit.')
 
-def list_db(db_folder):
+def list_db():
     """Lists all SQLite Databases the program knows about"""
-    for db in os.listdir(db_folder):
-        print(db)
+    for db in os.listdir(DB_FOLDER):
+        if db.endswith('.db'):
+            print(db)
 
-def list_tables(db_name, db_folder):
+def list_tables(db_name):
     """Lists all databases in the given SQLite Database"""
     db_file_name = db_name + '.db'
-    db_path = os.path.join(db_folder, db_file_name)
-    try:
-        conn = sqlite3.connect(db_path)
-    except(sqlite3.OperationalError):
+    db_path = os.path.join(DB_FOLDER, db_file_name)
+    if not os.path.isfile(db_path):
         error_str = 'There is no database with the name ' + db_name + '. Did you create the database before running the query?'
         raise Exception(error_str)
+    conn = open_db(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     print(cursor.fetchall())
@@ -228,22 +756,39 @@ if __name__ == '__main__':
                         metavar = 'file_to_import_args', 
                         dest='file_to_import_args', 
                         help="""Enter the name of the Database you want to add a file to. Then, type the full path to the file you want to add. The third argument is what you 
-                        want the table name to be. You can then add an optional fourth agument that represents a sheetname to take data from an xlsx file. All data imported should have 
-                        the names of the columns in the first row, and no other data in the file other than the table to import.""",
+                        want the table name to be. You can then add an optional fourth agument that represents a sheetname to take data from an xlsx file. More table name and sheetname 
+                        pairs can follow to import several sheets from the same xlsx file, which is only read once. All data imported should have the names of the columns in 
+                        the first row, and no other data in the file other than the table to import. To import many files at once in parallel, give the name of the Database 
+                        followed by the path to a .json file holding a list of objects, each with the "file" to import, the "table" to import it into, and an optional "sheet".""",
                         type = str,
                         nargs='+')
+    parser.add_argument('--downcast',
+                        dest='downcast',
+                        help="""Use with --import_file to store the columns of an excel file in the smallest dtypes that hold their values while importing, and text
+                        columns with few distinct values as categories. Lowers memory use when importing large files.""",
+                        action='store_true')
+    parser.add_argument('--fast_import',
+                        dest='fast_import',
+                        help="""Use with --import_file to load the rows of a CSV file with the .import command of the sqlite3 command line tool, which must be installed
+                        and on the PATH. Faster for very large files, but empty fields are stored as empty strings instead of NULL.""",
+                        action='store_true')
     parser.add_argument('-e','--execute',
                         metavar = 'execute_query', 
                         dest='query_to_execute', 
                         help="""Enter the query you want to run, or path to a .txt file holding the query you want to run, followed by the directory that you want the executed
-                                query to go as a saved excel file, followed by the name of the excel file output (no extention), followed by the SQlite DB to run the query 
-                                against. An optional fifth argument can be entered by typing "clear" which will clear the Database that the query is run against, as this is 
+                                query to go as a saved excel file, followed by the name of the excel file output (no extention, or end the name in .parquet or .csv to save a 
+                                parquet or csv file instead), followed by the SQlite DB to run the query against. An optional fifth argument can be entered by typing "clear" which will clear the Database that the query is run against, as this is 
                                 intended to be a lightweight tool. 
                                 
                                 The query should be surrounded by double quotation marks if given on command line. If given by .txt file, make sure the file only have the query
                                 in its text. Make sure the Database has been created before you try to execute the query, which can be done with the -b [database_name] command""",
                         type = str,
                         nargs='+')
+    parser.add_argument('--as_dataframe',
+                        dest='as_dataframe',
+                        help="""Use with --execute to read the query result into a pandas DataFrame before saving it, instead of streaming rows from the
+                        Database into the file. Results read this way, and results saved as .parquet files, are cached and reused when the same query is run again on an unchanged Database.""",
+                        action='store_true')
     parser.add_argument('-lt','--list_all_tables', 
                         metavar = 'list_table_db_name',
                         dest='list_table_db_name', 